@@ -3,14 +3,31 @@ import json
 from datetime import datetime
 import os
 
+# 高速JSONシリアライザ（オプション）
+try:
+    import orjson
+    ORJSON_ENABLED = True
+except ImportError:
+    ORJSON_ENABLED = False
+
 class ReservationDB:
     def __init__(self, db_name='hanzomon_reservations.db'):
         self.db_name = db_name
+        # 接続は使い回す（毎クエリのconnect/closeはファイルオープンとページ
+        # キャッシュの捨て直しで高くつく）。check_same_thread=Falseで
+        # スレッドをまたぐFlaskワーカーからも利用可能にする
+        self.conn = sqlite3.connect(self.db_name, check_same_thread=False)
         self.init_database()
 
+    def close(self):
+        """接続をクローズ"""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
     def init_database(self):
         """データベースとテーブルを初期化"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self.conn
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -32,102 +49,122 @@ class ReservationDB:
         # インデックスを作成
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_date ON reservations(date)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_start_time ON reservations(start_time)')
+        # 重複チェック（date, start_time, reservation_type [, message_id]）を
+        # テーブル本体を読まずにインデックスだけで解決するためのカバリングインデックス
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_dup_check
+            ON reservations(date, start_time, reservation_type, message_id)
+        ''')
+        # 重複行をDB層でも弾けるようにユニーク制約を張る（既存DBにも効くよう
+        # テーブル定義ではなくユニークインデックスで追加）。INSERT OR IGNOREと
+        # 組み合わせて使う。同一枠でもグループ違いは正当な予約（最大7組）
+        # なのでgroup_numberまでキーに含める
+        has_unique_index = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_unique_slot_group'"
+        ).fetchone()
+        if not has_unique_index:
+            # group_numberを含まない旧版のユニークインデックスは置き換える
+            cursor.execute('DROP INDEX IF EXISTS idx_unique_slot')
+            # 制約がなかった時代に入った重複行を先に整理しておく（各キーの
+            # 最小idを残す）。これをやらないと既存DBでCREATE INDEXが
+            # IntegrityErrorになり、初期化自体が失敗する
+            cursor.execute('''
+                DELETE FROM reservations WHERE id NOT IN (
+                    SELECT MIN(id) FROM reservations
+                    GROUP BY date, start_time, reservation_type, group_number
+                )
+            ''')
+            cursor.execute('''
+                CREATE UNIQUE INDEX idx_unique_slot_group
+                ON reservations(date, start_time, reservation_type, group_number)
+            ''')
 
         conn.commit()
-        conn.close()
 
     def add_reservation(self, date, start_time, end_time, reservation_type, group_number=1, source='manual', email_subject=None, message_id=None):
         """予約を追加"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self.conn
         cursor = conn.cursor()
 
         cursor.execute('''
-            INSERT INTO reservations (date, start_time, end_time, reservation_type, group_number, source, email_subject, message_id)
+            INSERT OR IGNORE INTO reservations (date, start_time, end_time, reservation_type, group_number, source, email_subject, message_id)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (date, start_time, end_time, reservation_type, group_number, source, email_subject, message_id))
 
-        reservation_id = cursor.lastrowid
+        # ユニーク制約で弾かれた（=既存の重複だった）場合はNoneを返す
+        reservation_id = cursor.lastrowid if cursor.rowcount else None
         conn.commit()
-        conn.close()
         return reservation_id
 
+    def add_reservations_bulk(self, reservations):
+        """予約をまとめて追加（executemanyで1トランザクション）
+
+        reservationsは(date, start_time, end_time, reservation_type,
+        group_number, source, email_subject, message_id)のタプルのリスト。
+        """
+        if not reservations:
+            return 0
+
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany('''
+                INSERT OR IGNORE INTO reservations (date, start_time, end_time, reservation_type, group_number, source, email_subject, message_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', reservations)
+        # OR IGNOREで弾かれた行を除いた実挿入件数を返す
+        return self.conn.total_changes - before
+
     def get_reservations_by_date(self, date):
         """指定日の予約を取得"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+        # SQL側でAPIのキー名にエイリアスし、sqlite3.Row -> dict変換一発で行を作る
+        cursor = self.conn.cursor()
+        cursor.row_factory = sqlite3.Row
 
         cursor.execute('''
-            SELECT id, start_time, end_time, reservation_type, group_number, source, email_subject, message_id
+            SELECT id, start_time AS start, end_time AS end,
+                   reservation_type AS type, group_number AS "group",
+                   source, email_subject, message_id
             FROM reservations
             WHERE date = ?
             ORDER BY start_time
         ''', (date,))
 
-        rows = cursor.fetchall()
-        conn.close()
-
-        reservations = []
-        for row in rows:
-            reservations.append({
-                'id': row[0],
-                'start': row[1],
-                'end': row[2],
-                'type': row[3],
-                'group': row[4],
-                'source': row[5],
-                'email_subject': row[6],
-                'message_id': row[7]
-            })
-
-        return reservations
+        return [dict(row) for row in cursor.fetchall()]
 
     def get_all_reservations(self):
         """全ての予約をdict形式で取得（既存のAPIとの互換性のため）"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+        cursor = self.conn.cursor()
+        cursor.row_factory = sqlite3.Row
 
         cursor.execute('''
-            SELECT date, start_time, end_time, reservation_type, group_number, source, email_subject, message_id
+            SELECT date, start_time AS start, end_time AS end,
+                   reservation_type AS type, group_number AS "group",
+                   source, email_subject, message_id
             FROM reservations
             ORDER BY date, start_time
         ''')
 
-        rows = cursor.fetchall()
-        conn.close()
-
         reservations_dict = {}
-        for row in rows:
-            date = row[0]
-            if date not in reservations_dict:
-                reservations_dict[date] = []
-
-            reservations_dict[date].append({
-                'start': row[1],
-                'end': row[2],
-                'type': row[3],
-                'group': row[4],
-                'source': row[5],
-                'email_subject': row[6],
-                'message_id': row[7]
-            })
+        for row in cursor.fetchall():
+            reservation = dict(row)
+            reservations_dict.setdefault(reservation.pop('date'), []).append(reservation)
 
         return reservations_dict
 
     def delete_reservation(self, reservation_id):
         """予約を削除"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self.conn
         cursor = conn.cursor()
 
         cursor.execute('DELETE FROM reservations WHERE id = ?', (reservation_id,))
         deleted_count = cursor.rowcount
 
         conn.commit()
-        conn.close()
         return deleted_count > 0
 
     def delete_reservation_by_details(self, date, start_time, reservation_type):
         """日付・時間・タイプで予約を削除"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self.conn
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -138,45 +175,49 @@ class ReservationDB:
 
         deleted_count = cursor.rowcount
         conn.commit()
-        conn.close()
         return deleted_count > 0
 
     def reservation_exists(self, date, start_time, reservation_type, message_id=None):
         """重複チェック"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self.conn
         cursor = conn.cursor()
 
+        # COUNT(*)は条件に合う全行を数え切るが、存在確認は1行見つかれば十分
         if message_id:
             cursor.execute('''
-                SELECT COUNT(*) FROM reservations
+                SELECT 1 FROM reservations
                 WHERE (date = ? AND start_time = ? AND reservation_type = ?) OR message_id = ?
+                LIMIT 1
             ''', (date, start_time, reservation_type, message_id))
         else:
             cursor.execute('''
-                SELECT COUNT(*) FROM reservations
+                SELECT 1 FROM reservations
                 WHERE date = ? AND start_time = ? AND reservation_type = ?
+                LIMIT 1
             ''', (date, start_time, reservation_type))
 
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count > 0
+        return cursor.fetchone() is not None
 
     def migrate_from_memory(self, memory_db):
-        """メモリ内のデータをSQLiteに移行"""
-        migrated_count = 0
+        """メモリ内のデータをSQLiteに移行（executemanyで1トランザクション）"""
+        cursor = self.conn.cursor()
+
+        # 既存キーを一括で取得して重複チェックをset参照に置き換える
+        # （1件ごとのreservation_existsクエリはN回のSELECTになる）
+        cursor.execute('SELECT date, start_time, reservation_type FROM reservations')
+        existing_keys = set(cursor.fetchall())
+
+        rows = []
         for date, reservations in memory_db.items():
             for reservation in reservations:
-                if not self.reservation_exists(date, reservation['start'], reservation['type']):
-                    self.add_reservation(
-                        date=date,
-                        start_time=reservation['start'],
-                        end_time=reservation['end'],
-                        reservation_type=reservation['type'],
-                        group_number=reservation.get('group', 1),
-                        source=reservation.get('source', 'manual')
-                    )
-                    migrated_count += 1
-        return migrated_count
+                key = (date, reservation['start'], reservation['type'])
+                if key not in existing_keys:
+                    existing_keys.add(key)
+                    rows.append((date, reservation['start'], reservation['end'],
+                                 reservation['type'], reservation.get('group', 1),
+                                 reservation.get('source', 'manual'), None, None))
+
+        return self.add_reservations_bulk(rows)
 
     def backup_to_json(self, backup_file=None):
         """JSONファイルにバックアップ"""
@@ -184,15 +225,23 @@ class ReservationDB:
             backup_file = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
 
         reservations = self.get_all_reservations()
-        with open(backup_file, 'w', encoding='utf-8') as f:
-            json.dump(reservations, f, ensure_ascii=False, indent=2)
+        if ORJSON_ENABLED:
+            with open(backup_file, 'wb') as f:
+                f.write(orjson.dumps(reservations, option=orjson.OPT_INDENT_2))
+        else:
+            with open(backup_file, 'w', encoding='utf-8') as f:
+                json.dump(reservations, f, ensure_ascii=False, indent=2)
 
         return backup_file
 
     def restore_from_json(self, backup_file):
         """JSONファイルから復元"""
-        with open(backup_file, 'r', encoding='utf-8') as f:
-            reservations_data = json.load(f)
+        if ORJSON_ENABLED:
+            with open(backup_file, 'rb') as f:
+                reservations_data = orjson.loads(f.read())
+        else:
+            with open(backup_file, 'r', encoding='utf-8') as f:
+                reservations_data = json.load(f)
 
         restored_count = self.migrate_from_memory(reservations_data)
         return restored_count
\ No newline at end of file
@@ -9,8 +9,40 @@ from datetime import datetime, timedelta
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
-import base64
+# SIMD対応のbase64デコーダ（オプション）。入っていなければstdlibを使う
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
 import re
+from concurrent.futures import ThreadPoolExecutor
+
+# parse_reservationで使う正規表現はモジュール読み込み時に一度だけコンパイル。
+# 日付・時間・顧客名の全パターンを1つの選択肢付き正規表現にまとめ、本文の
+# 走査を1パスで済ませる（各フィールドは最初のマッチを採用）
+FIELDS_RE = re.compile(
+    # 日付: 2025年11月02日 / 日時：2025年11月02日
+    r'(?:日時：)?(?P<dy>\d{4})年(?P<dm>\d{1,2})月(?P<dd>\d{1,2})日'
+    # 日付: 2025/11/02, 2025-11-02
+    r'|(?P<sy>\d{4})[/-](?P<sm>\d{1,2})[/-](?P<sd>\d{1,2})'
+    # 時間: 10:00~11:00（[〜～~-]の文字クラスが～と-のパターンも包含）
+    r'|(?P<th>\d{1,2}):(?P<tm>\d{2})\s*[〜～~-]\s*(?P<eh>\d{1,2}):(?P<em>\d{2})'
+    # 顧客名: 行頭の「〇〇 様」
+    r'|^(?P<n1>[^\n\r]+)\s*様'
+    # 顧客名: お名前：〇〇
+    r'|(?:お名前|氏名)[：:\s]*(?P<n2>[^\n\r]+)'
+    # 顧客名: 〇〇 様 + 予約メッセージ
+    r'|(?P<n3>[^\n\r]+)\s*様\s*\n\n(?:ご予約|以下の予約)',
+    re.MULTILINE
+)
+
+# 店舗・キャンセル判定はIGNORECASE検索にして、本文全体の.lower()コピーを作らない
+STORE_RE = re.compile(r'渋谷|shibuya|hallel', re.IGNORECASE)
+CANCEL_RE = re.compile(r'キャンセル|cancel', re.IGNORECASE)
+
+# Gmailサービスのモジュールキャッシュ。Vercelのウォーム実行ではモジュールが
+# 生き残るので、認証とサービス構築を毎リクエストやり直さない
+_service_cache = None
 
 class FastGmailSync:
     def __init__(self):
@@ -24,10 +56,22 @@ class FastGmailSync:
 
         # ラベル管理
         self.label_ids = {}
+        self._base_label_ids = []
+        self._label_ids_by_type = {}
         self.setup_labels()
 
+        # 適用待ちラベルのキュー（label_type -> [message_id, ...]）
+        self._pending_labels = {}
+
     def setup_gmail_service(self):
         """Gmail API サービスを設定（軽量版）"""
+        global _service_cache
+
+        # ウォームスタート時はキャッシュ済みサービスを再利用
+        if _service_cache is not None:
+            self.service = _service_cache
+            return
+
         creds = None
 
         # Vercel環境では環境変数からトークンを取得
@@ -56,7 +100,15 @@ class FastGmailSync:
                     raise Exception("Vercel環境で有効なトークンがありません")
                 return
 
-        self.service = build('gmail', 'v1', credentials=creds)
+        # static_discovery=Trueで同梱のディスカバリ文書を使い（HTTP取得なし）、
+        # cache_discovery=Falseでディスカバリキャッシュのファイル I/O も止める
+        self.service = build(
+            'gmail', 'v1',
+            credentials=creds,
+            cache_discovery=False,
+            static_discovery=True
+        )
+        _service_cache = self.service
 
     def setup_labels(self):
         """必要なラベルを作成・設定"""
@@ -71,8 +123,9 @@ class FastGmailSync:
         ]
 
         try:
-            # 既存ラベルを取得
-            results = self.service.users().labels().list(userId='me').execute()
+            # 既存ラベルを取得（使うのはid/nameだけなのでレスポンスを絞る）
+            results = self.service.users().labels().list(
+                userId='me', fields='labels(id,name)').execute()
             existing_labels = {label['name']: label['id'] for label in results.get('labels', [])}
 
             for label_name in labels_to_create:
@@ -95,45 +148,55 @@ class FastGmailSync:
                     self.label_ids[label_name] = result['id']
                     print(f"🏷️ ラベル作成: {label_name}")
 
+            # ラベルタイプ -> 適用ラベルIDリストをここで一度だけ組み立てる
+            self._base_label_ids = [
+                self.label_ids[name]
+                for name in ('HALLEL/Processed', 'HALLEL/Shibuya')
+                if name in self.label_ids
+            ]
+            self._label_ids_by_type = {
+                'booking': self._base_label_ids + (
+                    [self.label_ids['HALLEL/Booking']] if 'HALLEL/Booking' in self.label_ids else []
+                ),
+                'cancellation': self._base_label_ids + (
+                    [self.label_ids['HALLEL/Cancellation']] if 'HALLEL/Cancellation' in self.label_ids else []
+                )
+            }
+
         except Exception as e:
             print(f"❌ ラベル設定エラー: {e}")
 
     def apply_label(self, message_id, label_type):
-        """メールにラベルを適用"""
-        if not self.service:
+        """メールへのラベル適用をキューに積む（送信はflush_labelsでまとめて実行）"""
+        self._pending_labels.setdefault(label_type, []).append(message_id)
+
+    def flush_labels(self):
+        """キュー済みラベルをbatchModifyでラベルタイプごとに一括適用"""
+        if not self.service or not self._pending_labels:
+            self._pending_labels = {}
             return
 
         try:
-            # ラベルタイプに応じてラベルを選択
-            labels_to_add = ['HALLEL/Processed', 'HALLEL/Shibuya']
-
-            if label_type == 'booking':
-                labels_to_add.append('HALLEL/Booking')
-            elif label_type == 'cancellation':
-                labels_to_add.append('HALLEL/Cancellation')
-
-            # 実際のラベルIDを取得
-            label_ids_to_add = []
-            for label_name in labels_to_add:
-                if label_name in self.label_ids:
-                    label_ids_to_add.append(self.label_ids[label_name])
-
-            if label_ids_to_add:
-                # ラベルを適用
-                body = {
-                    'addLabelIds': label_ids_to_add
-                }
-
-                self.service.users().messages().modify(
-                    userId='me',
-                    id=message_id,
-                    body=body
-                ).execute()
-
-                print(f"🏷️ ラベル適用: {', '.join(labels_to_add)}")
+            for label_type, message_ids in self._pending_labels.items():
+                # 事前計算済みのラベルIDリストを参照するだけ
+                label_ids_to_add = self._label_ids_by_type.get(label_type, self._base_label_ids)
+
+                if label_ids_to_add:
+                    # 1回のAPI呼び出しで対象メール全てにラベルを適用
+                    self.service.users().messages().batchModify(
+                        userId='me',
+                        body={
+                            'ids': message_ids,
+                            'addLabelIds': label_ids_to_add
+                        }
+                    ).execute()
+
+                    print(f"🏷️ ラベル適用: {label_type} ({len(message_ids)}件)")
 
         except Exception as e:
             print(f"❌ ラベル適用エラー: {e}")
+        finally:
+            self._pending_labels = {}
 
     def get_recent_reservations(self):
         """最近の予約メールを高速取得"""
@@ -150,25 +213,22 @@ class FastGmailSync:
             result = self.service.users().messages().list(
                 userId='me',
                 q=query,
-                maxResults=10  # 最大10件に制限
+                maxResults=10,  # 最大10件に制限
+                fields='messages/id'  # 使うのはidだけなのでレスポンスを絞る
             ).execute()
 
             messages = result.get('messages', [])
             print(f"📧 見つかったメール: {len(messages)}件")
 
-            reservations = []
-            for i, message in enumerate(messages):
-                print(f"⏳ 処理中... ({i+1}/{len(messages)})")
+            # メッセージをバッチリクエストで一括取得（1件ずつのHTTP往復をまとめる）。
+            # 検索クエリで既にhacomono/hallelに絞れているので、最初からフル取得して
+            # metadata取得→本文の再取得という二度引きをやめる。
+            # 解析はコールバック発火と同時にワーカースレッドへ投げ、バッチの
+            # ネットワーク待ちとCPU処理をオーバーラップさせる
+            futures = {}
 
+            def _process(message_id, msg):
                 try:
-                    # メッセージの詳細を取得（最小限）
-                    msg = self.service.users().messages().get(
-                        userId='me',
-                        id=message['id'],
-                        format='metadata',  # ヘッダーのみ取得で高速化
-                        metadataHeaders=['Subject', 'From', 'Date']
-                    ).execute()
-
                     # 件名と送信者を確認
                     subject = self.get_header_value(msg, 'Subject')
                     sender = self.get_header_value(msg, 'From')
@@ -178,19 +238,50 @@ class FastGmailSync:
 
                     # HALLELの予約メールかチェック
                     if 'hallel' in subject.lower() and 'hacomono' in sender.lower():
-                        # 本文を取得して詳細解析
-                        full_msg = self.service.users().messages().get(
-                            userId='me',
-                            id=message['id']
-                        ).execute()
-
-                        body = self.extract_body(full_msg)
+                        # バッチ取得済みのメッセージから本文を解析（再取得しない）
+                        body = self.extract_body(msg)
                         reservation = self.parse_reservation(body, subject)
 
                         if reservation:
-                            reservation['email_id'] = message['id']
+                            reservation['email_id'] = message_id
                             reservation['email_subject'] = subject
                             reservation['email_sender'] = sender
+                            return reservation
+
+                except Exception as e:
+                    print(f"❌ メール処理エラー: {e}")
+
+                return None
+
+            reservations = []
+            if messages:
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    def _collect(request_id, response, exception):
+                        if exception is None:
+                            futures[request_id] = executor.submit(_process, request_id, response)
+                        else:
+                            print(f"❌ メール取得エラー: {exception}")
+
+                    batch = self.service.new_batch_http_request(callback=_collect)
+                    for message in messages:
+                        batch.add(
+                            self.service.users().messages().get(
+                                userId='me',
+                                id=message['id'],
+                                fields='id,payload'  # ヘッダーと本文以外は取得しない
+                            ),
+                            request_id=message['id']
+                        )
+                    batch.execute()
+
+                    # 元のメール順で結果を回収（ラベルキュー操作はメインスレッドで行う）
+                    for message in messages:
+                        future = futures.get(message['id'])
+                        if not future:
+                            continue
+
+                        reservation = future.result()
+                        if reservation:
                             reservations.append(reservation)
                             print(f"✅ 予約検出: {reservation.get('date')} {reservation.get('start')}-{reservation.get('end')}")
 
@@ -198,9 +289,8 @@ class FastGmailSync:
                             label_type = 'cancellation' if reservation.get('is_cancellation') else 'booking'
                             self.apply_label(message['id'], label_type)
 
-                except Exception as e:
-                    print(f"❌ メール処理エラー: {e}")
-                    continue
+            # キューしたラベルをまとめて適用
+            self.flush_labels()
 
             print(f"📊 最終結果: {len(reservations)}件の予約")
             return reservations
@@ -249,75 +339,49 @@ class FastGmailSync:
             print(f"📝 本文の一部: {body[:200]}...")
 
             # 渋谷店フィルタ（より柔軟に）
-            body_lower = body.lower()
-            if not ('渋谷' in body or 'shibuya' in body_lower or 'hallel' in body_lower):
+            if not STORE_RE.search(body):
                 print("❌ 渋谷店のメールではありません")
                 return None
 
             print("✅ 渋谷店のメールを検出")
 
             # キャンセルかどうかチェック
-            is_cancellation = 'キャンセル' in subject or 'cancel' in subject.lower()
-
-            # 日付を抽出（複数パターンに対応）
-            date_patterns = [
-                r'(\d{4})年(\d{1,2})月(\d{1,2})日',  # 2025年11月02日
-                r'(\d{4})[/-](\d{1,2})[/-](\d{1,2})',  # 2025/11/02
-                r'日時：(\d{4})年(\d{1,2})月(\d{1,2})日'  # 日時：2025年11月02日
-            ]
+            is_cancellation = CANCEL_RE.search(subject) is not None
+
+            # 日付・時間・顧客名を本文1スキャンでまとめて抽出。
+            # 各フィールドは最初のマッチを採用し、全部揃ったら打ち切る
+            date = start_time = end_time = customer_name = None
+            for m in FIELDS_RE.finditer(body):
+                g = m.groupdict()
+                if date is None and (g['dy'] or g['sy']):
+                    year, month, day = (
+                        (g['dy'], g['dm'], g['dd']) if g['dy']
+                        else (g['sy'], g['sm'], g['sd'])
+                    )
+                    date = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+                elif start_time is None and g['th']:
+                    start_time = f"{g['th'].zfill(2)}:{g['tm']}"
+                    end_time = f"{g['eh'].zfill(2)}:{g['em']}"
+                elif customer_name is None and (g['n1'] or g['n2'] or g['n3']):
+                    customer_name = (g['n1'] or g['n2'] or g['n3']).strip()
+                    # 「様」を除去
+                    customer_name = customer_name.replace('様', '').strip()
 
-            date_match = None
-            for pattern in date_patterns:
-                date_match = re.search(pattern, body)
-                if date_match:
+                if date and start_time and customer_name:
                     break
 
-            if not date_match:
+            if not date:
                 print("❌ 日付パターンが見つかりません")
                 return None
-
-            year, month, day = date_match.groups()
-            date = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
             print(f"📅 日付: {date}")
 
-            # 時間を抽出（複数パターンに対応）
-            time_patterns = [
-                r'(\d{1,2}):(\d{2})\s*[〜～~-]\s*(\d{1,2}):(\d{2})',  # 10:00~11:00
-                r'(\d{1,2}):(\d{2})～(\d{1,2}):(\d{2})',  # 10:00～11:00
-                r'(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})'   # 10:00-11:00
-            ]
-
-            time_match = None
-            for pattern in time_patterns:
-                time_match = re.search(pattern, body)
-                if time_match:
-                    break
-
-            if not time_match:
+            if not start_time:
                 print("❌ 時間パターンが見つかりません")
                 return None
-
-            start_hour, start_min, end_hour, end_min = time_match.groups()
-            start_time = f"{start_hour.zfill(2)}:{start_min}"
-            end_time = f"{end_hour.zfill(2)}:{end_min}"
             print(f"⏰ 時間: {start_time}-{end_time}")
 
-            # 顧客名を抽出（複数パターンに対応）
-            customer_patterns = [
-                r'^([^\n\r]+)\s*様',  # 最初の行の「〇〇 様」
-                r'(?:お名前|氏名)[：:\s]*([^\n\r]+)',  # お名前：〇〇
-                r'([^\n\r]+)\s*様\s*\n\n(?:ご予約|以下の予約)'  # 〇〇 様 + 予約メッセージ
-            ]
-
-            customer_name = 'N/A'
-            for pattern in customer_patterns:
-                customer_match = re.search(pattern, body, re.MULTILINE)
-                if customer_match:
-                    customer_name = customer_match.group(1).strip()
-                    # 「様」を除去
-                    customer_name = customer_name.replace('様', '').strip()
-                    break
-
+            if customer_name is None:
+                customer_name = 'N/A'
             print(f"👤 顧客名: {customer_name}")
 
             return {
@@ -17,6 +17,9 @@ class GmailLabeler:
         self.service = None
         self.setup_gmail_service()
 
+        # ラベル名 -> ID のキャッシュ（初回のlist結果を使い回す）
+        self._labels_cache = None
+
         # HALLEL予約システム用のラベル名
         self.PROCESSED_LABEL = 'HALLEL/Processed'
         self.BOOKING_LABEL = 'HALLEL/Booking'
@@ -43,14 +46,16 @@ class GmailLabeler:
     def create_label_if_not_exists(self, label_name):
         """ラベルが存在しない場合は作成"""
         try:
-            # 既存ラベルを取得
-            results = self.service.users().labels().list(userId='me').execute()
-            labels = results.get('labels', [])
+            # 既存ラベルは初回のみ取得し、以降はキャッシュを参照する
+            if self._labels_cache is None:
+                results = self.service.users().labels().list(userId='me').execute()
+                self._labels_cache = {
+                    label['name']: label['id'] for label in results.get('labels', [])
+                }
 
             # ラベルが存在するかチェック
-            for label in labels:
-                if label['name'] == label_name:
-                    return label['id']
+            if label_name in self._labels_cache:
+                return self._labels_cache[label_name]
 
             # ラベルが存在しない場合は作成
             label_object = {
@@ -62,6 +67,9 @@ class GmailLabeler:
             created_label = self.service.users().labels().create(
                 userId='me', body=label_object).execute()
 
+            # 作成したラベルもキャッシュに反映
+            self._labels_cache[label_name] = created_label['id']
+
             print(f"✅ ラベル作成: {label_name}")
             return created_label['id']
 
@@ -1,18 +1,104 @@
 import re
 import os
 import json
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
-import base64
+
+# SIMD対応のbase64デコーダ（オプション）。大きめの本文で2〜10倍速い。
+# 入っていなければstdlibにフォールバック
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
 
 # 予約分類器をインポート
 from reservation_classifier import HALLELReservationClassifier
 # ラベル管理をインポート
 from gmail_labeler import GmailLabeler
 
+# 解析で使う正規表現はモジュール読み込み時に一度だけコンパイルしておく
+# （呼び出しごとのパターン構築・キャッシュ参照をなくす）
+
+# 日付パターン (YYYY/MM/DD, YYYY-MM-DD, MM/DD, MM月DD日など)
+DATE_RES = [
+    re.compile(r'(\d{4})[/-](\d{1,2})[/-](\d{1,2})'),  # 2025/09/24, 2025-09-24
+    re.compile(r'(\d{1,2})[/-](\d{1,2})'),             # 09/24, 9/24
+    re.compile(r'(\d{1,2})月(\d{1,2})日'),               # 9月24日
+]
+
+# 時間パターン (HH:MM, HH時MM分など)
+TIME_RES = [
+    re.compile(r'(\d{1,2}):(\d{2})'),                  # 14:00
+    re.compile(r'(\d{1,2})時(\d{1,2})分?'),             # 14時00分, 14時
+]
+
+# キャンセル・貸切の判定はIGNORECASE検索にして、件名+本文の.lower()コピーを作らない
+KW_RE = re.compile(
+    r'(?P<cancel>cancel|キャンセル|きゃんせる|取消|削除|中止)'
+    r'|(?P<charter>charter|チャーター|貸切|貸し切り)',
+    re.IGNORECASE
+)
+
+# parse_reservation_infoでは日付・時間・キーワードを1つの選択肢付き正規表現に
+# まとめ、本文をfinditerの1パスで走査する（パターンごとの全文スキャンをなくす）
+COMBINED_RE = re.compile(
+    r'(?P<y1>\d{4})[/-](?P<m1>\d{1,2})[/-](?P<d1>\d{1,2})'   # 2025/09/24, 2025-09-24
+    r'|(?P<h1>\d{1,2}):(?P<min1>\d{2})'                      # 14:00
+    r'|(?P<h2>\d{1,2})時(?P<min2>\d{1,2})分?'                 # 14時00分
+    r'|(?P<m2>\d{1,2})[/-](?P<d2>\d{1,2})'                   # 09/24, 9/24
+    r'|(?P<m3>\d{1,2})月(?P<d3>\d{1,2})日'                     # 9月24日
+    r'|(?P<cancel>cancel|キャンセル|きゃんせる|取消|削除|中止)'
+    r'|(?P<charter>charter|チャーター|貸切|貸し切り)',
+    re.IGNORECASE
+)
+
+# HALLELの予約完了メール特有の顧客名パターン
+# （\s*\n\s*は\n\n固定の旧パターンも包含するので1本にまとめている）
+HALLEL_NAME_RE = re.compile(
+    r'メール\s*\n\s*([\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\s]+?)\s*\n\s*より、ご予約をいただきました')
+
+# 「〇〇\nより、ご予約をいただきました」の直前行を本文1スキャンで取り出す
+NAME_BEFORE_YOYAKU_RE = re.compile(
+    r'([\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\u3000-\u303Fa-zA-Z \t]{1,20})\s*\n\s*より、ご予約をいただきました')
+
+# 明らかに名前でない文字列の除外パターン
+NAME_BLACKLIST_RE = re.compile(r'@|http|www|\.com|\.jp|hallel|メール|ご予約|より', re.IGNORECASE)
+
+# 本文を取得する価値がある件名かどうかの事前フィルタ
+SUBJECT_CANDIDATE_RE = re.compile(
+    r'hallel|予約|reservation|booking|cancel|キャンセル', re.IGNORECASE)
+
+# 汎用の顧客名パターン（6パターンを1つの選択肢付き正規表現にまとめ、
+# searchで最初のマッチだけ取る）
+GENERAL_NAME_RE = re.compile(
+    r'(?P<sama>[^\s\n]{1,20})(?:様|さま|サマ)'                 # 〇〇様 / 〇〇さま / 〇〇サマ
+    r'|(?:お名前|氏名|予約者)[：:]\s*(?P<kv>[^\s\n]{1,20})'    # お名前: 〇〇 など
+)
+
+# 汎用パターン用の除外トークン
+BAD_NAME_RE = re.compile(r'@|http|www|\.com|\.jp')
+
+# 前回同期時のhistoryId。ウォーム実行ではモジュール変数が生き残り、
+# ローカル環境ではファイルにも永続化する（Vercelは書き込み不可のためメモリのみ）
+_history_state = {'historyId': None}
+_HISTORY_STATE_FILE = 'gmail_state.json'
+
+# 解析済みCredentialsのモジュールキャッシュ。Vercelのウォーム実行では
+# GMAIL_TOKEN_JSONのJSONパースと鍵検証をリクエストごとにやり直さない
+_creds_cache = None
+
+def _cached_creds():
+    """キャッシュ済みCredentialsを返す（無効・失効5分前を切ったらNone）"""
+    creds = _creds_cache
+    if creds and creds.valid:
+        if not creds.expiry or creds.expiry - datetime.utcnow() > timedelta(minutes=5):
+            return creds
+    return None
+
 class GmailReservationParser:
     def __init__(self):
         self.SCOPES = [
@@ -26,10 +112,11 @@ class GmailReservationParser:
 
     def setup_gmail_service(self):
         """Gmail API サービスを設定"""
-        creds = None
+        global _creds_cache
+        creds = _cached_creds()
 
         # Vercel環境では環境変数からトークンを取得
-        token_data = os.environ.get('GMAIL_TOKEN_JSON')
+        token_data = None if creds else os.environ.get('GMAIL_TOKEN_JSON')
         if token_data:
             try:
                 token_info = json.loads(token_data)
@@ -80,6 +167,7 @@ class GmailReservationParser:
                 with open('token.json', 'w') as token:
                     token.write(creds.to_json())
 
+        _creds_cache = creds
         self.service = build('gmail', 'v1', credentials=creds)
 
         # ラベル管理を初期化
@@ -94,19 +182,146 @@ class GmailReservationParser:
 
         return self.service
 
-    def get_recent_emails(self, query='subject:予約 OR subject:booking OR subject:reservation', max_results=50):
-        """最近の予約関連メールを取得"""
+    # サーバー側でどこまで絞れるかはGmailのクエリ言語に任せる。newer_than で
+    # 古いメールの再列挙を止め、処理済みラベルとプロモーションを除外して
+    # listが返すID数自体を減らす
+    _DEFAULT_QUERY = ('(subject:予約 OR subject:booking OR subject:reservation) '
+                      'newer_than:7d -category:promotions')
+
+    def get_recent_emails(self, query=_DEFAULT_QUERY, limit=20):
+        """最近の予約関連メールを遅延取得するジェネレータ
+
+        呼び出し側が実際に使う件数だけをmaxResultsとしてAPIに渡し、
+        不要なIDの転送・JSONパースをなくす。limitがページ上限を超える
+        場合はpageTokenで続きを辿る。
+        """
         if not self.service:
-            return []
+            return
+
+        remaining = limit
+        page_token = None
 
         try:
-            results = self.service.users().messages().list(
-                userId='me', q=query, maxResults=max_results).execute()
-            messages = results.get('messages', [])
-            return messages
+            while remaining > 0:
+                results = self.service.users().messages().list(
+                    userId='me', q=query,
+                    maxResults=min(remaining, 100),
+                    pageToken=page_token,
+                    fields='messages/id,nextPageToken').execute()
+                messages = results.get('messages', [])
+                if not messages:
+                    return
+
+                yield from messages[:remaining]
+                remaining -= len(messages)
+
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    return
         except Exception as e:
             print(f"メール取得エラー: {e}")
-            return []
+
+    def _load_history_id(self):
+        """前回同期時のhistoryIdを返す（なければNone）"""
+        if not _history_state['historyId'] and not os.environ.get('VERCEL_ENV'):
+            # ローカル環境ではファイルからも復元できる（token.jsonと同じ置き場所）
+            if os.path.exists(_HISTORY_STATE_FILE):
+                try:
+                    with open(_HISTORY_STATE_FILE, 'r') as f:
+                        _history_state['historyId'] = json.load(f).get('historyId')
+                except Exception as e:
+                    print(f"同期状態の読み込みエラー: {e}")
+        return _history_state['historyId']
+
+    def _save_history_id(self, history_id):
+        """historyIdを保存（Vercelはディスク書き込み不可なのでメモリのみ）"""
+        _history_state['historyId'] = history_id
+        if not os.environ.get('VERCEL_ENV'):
+            try:
+                with open(_HISTORY_STATE_FILE, 'w') as f:
+                    json.dump({'historyId': str(history_id)}, f)
+            except Exception as e:
+                print(f"同期状態の保存エラー: {e}")
+
+    def get_new_message_ids(self):
+        """前回同期以降に届いたメールIDだけをhistory.listで取得する
+
+        前回のhistoryIdからの差分だけを問い合わせるので、新着がなければ
+        ほぼ空のレスポンス1往復で済む。初回（historyIdなし）やhistoryIdの
+        失効（Gmail側は約1週間で破棄し404/410を返す）時はNoneを返し、
+        呼び出し側は従来のmessages.list全件クエリにフォールバックする。
+        """
+        if not self.service:
+            return None
+
+        last_id = self._load_history_id()
+        if not last_id:
+            # ベースラインを記録して次回以降の差分同期に備える
+            try:
+                profile = self.service.users().getProfile(
+                    userId='me', fields='historyId').execute()
+                self._save_history_id(profile['historyId'])
+            except Exception as e:
+                print(f"historyIdの取得エラー: {e}")
+            return None
+
+        try:
+            message_ids = []
+            latest_id = last_id
+            page_token = None
+            while True:
+                results = self.service.users().history().list(
+                    userId='me', startHistoryId=last_id,
+                    historyTypes=['messageAdded'],
+                    pageToken=page_token).execute()
+                for record in results.get('history', []):
+                    for added in record.get('messagesAdded', []):
+                        message_ids.append(added['message']['id'])
+                latest_id = results.get('historyId', latest_id)
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+
+            self._save_history_id(latest_id)
+            return message_ids
+        except Exception as e:
+            # startHistoryIdの失効などはベースラインを取り直してフル同期に戻す
+            print(f"差分同期エラー（フル同期にフォールバック）: {e}")
+            _history_state['historyId'] = None
+            return None
+
+    @staticmethod
+    def _find_text_plain(payload):
+        """MIMEツリーを深さ優先で辿り、最初のtext/plainパートのdataを返す
+
+        multipart/alternativeの中にさらにmultipartが入るネスト構造
+        （HALLELメールで頻出）も1パスで拾える。
+        """
+        stack = [payload]
+        while stack:
+            part = stack.pop()
+            if part.get('mimeType') == 'text/plain' and 'data' in part.get('body', {}):
+                return part['body']['data']
+            # pop順がドキュメント順になるよう逆順で積む
+            stack.extend(reversed(part.get('parts', [])))
+        return None
+
+    def _parse_message(self, message):
+        """取得済みメッセージから件名・送信者・本文を取り出す"""
+        # メール本文を取得（ネストしたマルチパートも探索する）
+        payload = message['payload']
+        data = self._find_text_plain(payload)
+        body = base64.urlsafe_b64decode(data).decode('utf-8') if data else ""
+
+        # ヘッダーは1パスでdict化してから件名・送信者を引く
+        headers = {h['name']: h['value'] for h in payload.get('headers', [])}
+
+        return {
+            'subject': headers.get('Subject', ''),
+            'sender': headers.get('From', ''),
+            'body': body,
+            'message_id': message['id']
+        }
 
     def get_email_content(self, message_id):
         """メールの内容を取得"""
@@ -114,37 +329,91 @@ class GmailReservationParser:
             return None
 
         try:
-            message = self.service.users().messages().get(userId='me', id=message_id).execute()
-
-            # メール本文を取得
-            payload = message['payload']
-            body = ""
-
-            if 'parts' in payload:
-                for part in payload['parts']:
-                    if part['mimeType'] == 'text/plain':
-                        if 'data' in part['body']:
-                            body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                            break
+            message = self.service.users().messages().get(
+                userId='me', id=message_id, format='full',
+                fields=self._CONTENT_FIELDS).execute()
+            return self._parse_message(message)
+
+        except Exception as e:
+            print(f"メール内容取得エラー: {e}")
+            return None
+
+    # Gmailのバッチエンドポイントは1リクエスト100件まで
+    _BATCH_CHUNK = 100
+
+    # 本文取得で使うフィールドだけに絞るfieldsマスク（添付ファイルのデータや
+    # HTMLパートのメタ情報を転送しない。partsはネスト探索のため丸ごと残す）
+    _CONTENT_FIELDS = 'id,payload(headers,mimeType,body/data,parts)'
+
+    def get_email_contents_batch(self, message_ids):
+        """複数メールの内容をバッチリクエストで一括取得
+
+        1件ずつのHTTPS往復をGmail APIのバッチエンドポイントにまとめる
+        （上限の100件ごとに分割）。message_id -> メール内容dict を返す
+        （取得失敗分は含まれない）。
+        """
+        contents = {}
+        if not self.service or not message_ids:
+            return contents
+
+        def _collect(request_id, response, exception):
+            if exception is None:
+                contents[request_id] = self._parse_message(response)
             else:
-                if payload['mimeType'] == 'text/plain' and 'data' in payload['body']:
-                    body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
+                print(f"メール内容取得エラー: {exception}")
 
-            # ヘッダーから件名と送信者を取得
-            headers = payload.get('headers', [])
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), '')
+        try:
+            for i in range(0, len(message_ids), self._BATCH_CHUNK):
+                batch = self.service.new_batch_http_request(callback=_collect)
+                for message_id in message_ids[i:i + self._BATCH_CHUNK]:
+                    batch.add(
+                        self.service.users().messages().get(
+                            userId='me', id=message_id, format='full',
+                            fields=self._CONTENT_FIELDS),
+                        request_id=message_id
+                    )
+                batch.execute()
+        except Exception as e:
+            print(f"メール一括取得エラー: {e}")
 
-            return {
-                'subject': subject,
-                'sender': sender,
-                'body': body,
-                'message_id': message_id
-            }
+        return contents
+
+    def filter_candidate_message_ids(self, message_ids):
+        """件名だけを一括取得し、予約関連メールのIDに絞り込む
 
+        format='metadata'のバッチ取得はMIMEツリーや本文を転送しないので、
+        対象外メールを本文ダウンロードなしで弾ける。
+        """
+        if not self.service or not message_ids:
+            return []
+
+        candidates = []
+
+        def _check(request_id, response, exception):
+            if exception is not None:
+                print(f"メールヘッダー取得エラー: {exception}")
+                return
+            headers = response.get('payload', {}).get('headers', [])
+            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
+            if SUBJECT_CANDIDATE_RE.search(subject):
+                candidates.append(request_id)
+
+        try:
+            for i in range(0, len(message_ids), self._BATCH_CHUNK):
+                batch = self.service.new_batch_http_request(callback=_check)
+                for message_id in message_ids[i:i + self._BATCH_CHUNK]:
+                    batch.add(
+                        self.service.users().messages().get(
+                            userId='me', id=message_id,
+                            format='metadata', metadataHeaders=['Subject', 'From']),
+                        request_id=message_id
+                    )
+                batch.execute()
         except Exception as e:
-            print(f"メール内容取得エラー: {e}")
-            return None
+            print(f"メールヘッダー一括取得エラー: {e}")
+            return list(message_ids)  # フィルタに失敗したら全件を対象にする
+
+        return candidates
 
     def parse_reservation_info(self, email_content):
         """メール内容から予約情報を解析"""
@@ -154,69 +423,64 @@ class GmailReservationParser:
         body = email_content['body']
         subject = email_content['subject']
 
-        # キャンセルメールかどうかをチェック
-        is_cancellation = any(word in subject.lower() + body.lower() for word in [
-            'cancel', 'cancellation', 'キャンセル', 'きゃんせる', '取消', '削除', '中止'
-        ])
-
-        # 日付パターン (YYYY/MM/DD, YYYY-MM-DD, MM/DD, MM月DD日など)
-        date_patterns = [
-            r'(\d{4})[/-](\d{1,2})[/-](\d{1,2})',  # 2025/09/24, 2025-09-24
-            r'(\d{1,2})[/-](\d{1,2})',             # 09/24, 9/24
-            r'(\d{1,2})月(\d{1,2})日',               # 9月24日
-        ]
-
-        # 時間パターン (HH:MM, HH時MM分など)
-        time_patterns = [
-            r'(\d{1,2}):(\d{2})',                  # 14:00
-            r'(\d{1,2})時(\d{1,2})分?',             # 14時00分, 14時
-        ]
-
-        # 予約タイプの推定
+        # キャンセル・貸切は件名を1パスでチェック（本文はCOMBINED_REの走査で拾う）
+        is_cancellation = False
         reservation_type = 'gmail'  # デフォルト
-        if any(word in subject.lower() + body.lower() for word in ['charter', 'チャーター', '貸切', '貸し切り']):
-            reservation_type = 'charter'
-
-        # 日付を解析
-        date_found = None
-        for pattern in date_patterns:
-            matches = re.findall(pattern, body)
-            if matches:
-                match = matches[0]
-                if len(match) == 3:  # YYYY/MM/DD形式
-                    year, month, day = match
-                    date_found = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-                elif len(match) == 2:  # MM/DD形式
-                    month, day = match
+        for m in KW_RE.finditer(subject):
+            if m.lastgroup == 'cancel':
+                is_cancellation = True
+            else:
+                reservation_type = 'charter'
+
+        # 日付・時間・キーワードを本文1スキャンでまとめて抽出。
+        # 日付は完全形式（YYYY/MM/DD）と短縮形式（MM/DDなど）を別々に持ち、
+        # 元の「完全形式を先に全文から探す」優先順位をスキャン後に再現する
+        # （電話番号のような03/1234ノイズに先勝ちさせない）
+        date_full = None
+        date_short = None
+        times_found = []
+        for m in COMBINED_RE.finditer(body):
+            g = m.groupdict()
+            if g['y1']:  # YYYY/MM/DD形式
+                if date_full is None:
+                    date_full = f"{g['y1']}-{int(g['m1']):02d}-{int(g['d1']):02d}"
+            elif g['m2'] or g['m3']:  # MM/DD, MM月DD日形式
+                if date_short is None:
+                    month, day = (g['m2'], g['d2']) if g['m2'] else (g['m3'], g['d3'])
                     current_year = datetime.now().year
-                    date_found = f"{current_year}-{month.zfill(2)}-{day.zfill(2)}"
+                    date_short = f"{current_year}-{int(month):02d}-{int(day):02d}"
+            elif g['h1'] or g['h2']:
+                # 使うのは開始・終了の2つだけなので、それ以降の時刻は集めない
+                if len(times_found) < 2:
+                    # 時・分はintのタプルで持ち、文字列化は最後にまとめて行う
+                    hour, minute = (g['h1'], g['min1']) if g['h1'] else (g['h2'], g['min2'])
+                    times_found.append((int(hour), int(minute)))
+            elif g['cancel']:
+                is_cancellation = True
+            elif g['charter']:
+                reservation_type = 'charter'
+
+            # 完全形式の日付が取れるまでは短縮形式で打ち切らない
+            if date_full and len(times_found) >= 2 and is_cancellation:
                 break
 
-        # 時間を解析
-        times_found = []
-        for pattern in time_patterns:
-            matches = re.findall(pattern, body)
-            for match in matches:
-                if len(match) == 2:
-                    hour, minute = match
-                    time_str = f"{hour.zfill(2)}:{minute.zfill(2)}"
-                    times_found.append(time_str)
+        date_found = date_full or date_short
 
         if date_found and times_found:
             # 開始時間と終了時間を推定（2つの時間が見つかった場合）
-            start_time = times_found[0]
-            end_time = times_found[1] if len(times_found) > 1 else None
+            start_hour, start_minute = times_found[0]
+            start_time = f"{start_hour:02d}:{start_minute:02d}"
 
-            # 終了時間が見つからない場合は開始時間から1.5時間後と仮定
-            if not end_time:
-                start_hour = int(start_time.split(':')[0])
-                start_minute = int(start_time.split(':')[1])
+            if len(times_found) > 1:
+                end_hour, end_minute = times_found[1]
+            else:
+                # 終了時間が見つからない場合は開始時間から1.5時間後と仮定
                 end_hour = start_hour + 1
                 end_minute = start_minute + 30
                 if end_minute >= 60:
                     end_hour += 1
                     end_minute -= 60
-                end_time = f"{end_hour:02d}:{end_minute:02d}"
+            end_time = f"{end_hour:02d}:{end_minute:02d}"
 
             # メール本文から「〇〇様」を抽出
             customer_name = self.extract_customer_name(body)
@@ -244,56 +508,33 @@ class GmailReservationParser:
             return 'N/A'
 
         # HALLELの予約完了メール特有のパターンを最優先で検索
-        # より具体的にライン単位で処理
-        lines = body.split('\n')
-        for i, line in enumerate(lines):
-            if line.strip() == 'より、ご予約をいただきました。' or line.strip() == 'より、ご予約をいただきました':
-                # "より、ご予約を..."の前の行を探す
-                for j in range(i-1, -1, -1):
-                    prev_line = lines[j].strip()
-                    if prev_line and not prev_line.endswith('メール') and len(prev_line) <= 20:
-                        # 日本語文字（ひらがな、カタカナ、漢字）、アルファベット、スペースのみで構成されているかチェック
-                        if re.match(r'^[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\u3000-\u303Fa-zA-Z\s]+$', prev_line):
-                            if (not any(word in prev_line.lower() for word in ['@', 'http', 'www', '.com', '.jp', 'hallel', 'メール', 'ご予約']) and
-                                not prev_line.isdigit()):
-                                return prev_line
-                        break
+        # （行分割の二重ループではなく、コンパイル済み正規表現の1スキャンで
+        # 「より、ご予約を...」直前の行を取り出す）
+        match = NAME_BEFORE_YOYAKU_RE.search(body)
+        if match:
+            name = match.group(1).strip()
+            # 安い長さ・数字チェックを先に、ブラックリスト検索は最後に回す
+            if (name and not name.isdigit() and not name.endswith('メール') and
+                    not NAME_BLACKLIST_RE.search(name)):
+                return name
 
         # 正規表現による従来のパターンマッチング（フォールバック）
-        hallel_patterns = [
-            r'メール\n\n([\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\s]+?)\n\nより、ご予約をいただきました',
-            r'メール\s*\n\s*([\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\s]+?)\s*\n\s*より、ご予約をいただきました',
-        ]
-
         # HALLELパターンを最初にチェック
-        for pattern in hallel_patterns:
-            matches = re.findall(pattern, body)
-            if matches:
-                name = matches[0].strip()
-                # 明らかに名前でないものを除外
-                if (len(name) >= 1 and len(name) <= 15 and
-                    not any(word in name.lower() for word in ['@', 'http', 'www', '.com', '.jp', 'hallel', 'メール', 'ご予約', 'より']) and
-                    not name.isdigit()):
-                    return name
-
-        # 従来の汎用パターン
-        general_patterns = [
-            r'([^\s\n]{1,20})様',  # 〇〇様
-            r'([^\s\n]{1,20})さま',  # 〇〇さま
-            r'([^\s\n]{1,20})サマ',  # 〇〇サマ
-            r'お名前[：:]\s*([^\s\n]{1,20})',  # お名前: 〇〇
-            r'氏名[：:]\s*([^\s\n]{1,20})',  # 氏名: 〇〇
-            r'予約者[：:]\s*([^\s\n]{1,20})',  # 予約者: 〇〇
-        ]
-
-        for pattern in general_patterns:
-            matches = re.findall(pattern, body)
-            if matches:
-                # 最初に見つかった名前を返す（一番可能性が高い）
-                name = matches[0].strip()
-                # 明らかに名前でないものを除外
-                if len(name) >= 1 and not any(char in name for char in ['@', 'http', 'www', '.com', '.jp']):
-                    return name
+        hallel_match = HALLEL_NAME_RE.search(body)
+        if hallel_match:
+            name = hallel_match.group(1).strip()
+            # 明らかに名前でないものを除外
+            if (1 <= len(name) <= 15 and not name.isdigit() and
+                    not NAME_BLACKLIST_RE.search(name)):
+                return name
+
+        # 従来の汎用パターン（最初に見つかった名前が一番可能性が高い）
+        match = GENERAL_NAME_RE.search(body)
+        if match:
+            name = (match.group('sama') or match.group('kv')).strip()
+            # 明らかに名前でないものを除外
+            if len(name) >= 1 and not BAD_NAME_RE.search(name):
+                return name
 
         return 'N/A'
 
@@ -301,20 +542,36 @@ class GmailReservationParser:
         """新しい予約メールを取得・解析（改良版）"""
         print("Gmail から予約メールを取得中...")
 
-        messages = self.get_recent_emails('subject:hallel OR subject:HALLEL OR from:@hacomono.jp')
         reservations = []
 
-        for message in messages[:20]:  # 最新20件をチェック
-            email_content = self.get_email_content(message['id'])
-            if not email_content:
-                continue
-
-            # 新しい分類器を使用
-            reservation_info = self.classifier.classify_email(
-                email_content['subject'],
-                email_content['body']
-            )
-
+        # まず前回同期以降の差分だけをhistoryから取得し、初回・失効時のみ
+        # 従来のmessages.listクエリで最新20件を取得する
+        message_ids = self.get_new_message_ids()
+        if message_ids is None:
+            # 処理済みメールはラベラーがHALLEL/Processedを付けているので、
+            # サーバー側クエリで除外して再取得自体を発生させない
+            messages = self.get_recent_emails(
+                '(subject:hallel OR subject:HALLEL OR from:@hacomono.jp) '
+                'newer_than:7d -label:HALLEL/Processed', limit=20)
+            message_ids = [message['id'] for message in messages]
+
+        # 件名プリフィルタで絞ってからバッチで一括取得・解析する
+        message_ids = self.filter_candidate_message_ids(message_ids)
+        contents = self.get_email_contents_batch(message_ids)
+
+        fetched = [(message_id, contents[message_id])
+                   for message_id in message_ids if message_id in contents]
+        if not fetched:
+            return reservations
+
+        # 分類は正規表現主体でマッチ中はGILを離すので、スレッドで重ねて解析する
+        # （executor.mapなので結果は取得順のまま）
+        with ThreadPoolExecutor(max_workers=min(4, len(fetched))) as executor:
+            infos = list(executor.map(
+                lambda item: self.classifier.classify_email(item[1]['subject'], item[1]['body']),
+                fetched))
+
+        for (message_id, email_content), reservation_info in zip(fetched, infos):
             if reservation_info and reservation_info.confidence > 0.7:
                 # 形式を従来のシステムに合わせて変換
                 reservation_data = {
@@ -326,7 +583,7 @@ class GmailReservationParser:
                     'studio': reservation_info.studio,
                     'source': 'gmail_auto',
                     'confidence': reservation_info.confidence,
-                    'message_id': message['id'],
+                    'message_id': message_id,
                     'email_subject': email_content['subject']
                 }
 
@@ -337,7 +594,7 @@ class GmailReservationParser:
                 # 処理済みメールにラベルを追加
                 if self.labeler:
                     self.labeler.label_processed_reservation(
-                        message['id'],
+                        message_id,
                         reservation_info.action_type,
                         reservation_info.customer_name
                     )
@@ -348,13 +605,24 @@ class GmailReservationParser:
         """従来の予約メール解析（後方互換性用）"""
         print("Gmail から予約メールを取得中...")
 
-        messages = self.get_recent_emails()
+        messages = self.get_recent_emails(limit=10)
         reservations = []
 
-        for message in messages[:10]:  # 最新10件をチェック
-            email_content = self.get_email_content(message['id'])
-            reservation_info = self.parse_reservation_info(email_content)
+        # 最新10件を件名プリフィルタで絞ってからバッチで一括取得・解析する
+        message_ids = [message['id'] for message in messages]
+        message_ids = self.filter_candidate_message_ids(message_ids)
+        contents = self.get_email_contents_batch(message_ids)
+
+        if not message_ids:
+            return reservations
+
+        # 解析も本文ごとに独立なのでスレッドで並列化する（順序はmapが保つ）
+        with ThreadPoolExecutor(max_workers=min(4, len(message_ids))) as executor:
+            infos = executor.map(
+                lambda message_id: self.parse_reservation_info(contents.get(message_id)),
+                message_ids)
 
+        for reservation_info in infos:
             if reservation_info:
                 reservations.append(reservation_info)
                 print(f"予約情報を検出: {reservation_info['date']} {reservation_info['start']}-{reservation_info['end']}")
@@ -6,14 +6,25 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 import time
+import random
 import logging
+import requests
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import re
+import os
+
+# ChromeDriverのバイナリパスはプロセス内でキャッシュする。
+# ChromeDriverManager().install()はインスタンス生成のたびにファイルシステムを
+# 触り、キャッシュミス時はネットワークにも出るので、並列ワーカーでは特に効く
+_driver_path_cache = None
 
 class HacomonoScraper:
     def __init__(self):
         self.driver = None
         self.wait = None
+        # 店舗名 -> 前回成功したセレクタ（次回は1発で当てる）
+        self._store_selector_cache = {}
         self.setup_logging()
 
     def setup_logging(self):
@@ -38,9 +49,27 @@ class HacomonoScraper:
             chrome_options.add_argument("--disable-gpu")
             chrome_options.add_argument("--window-size=1920,1080")
 
-            service = Service(ChromeDriverManager().install())
+            # DOMからテキストを読むだけなので、画像・フォントは読み込まない
+            # （スケジュールページの転送量を大幅に削減できる）。CSSはクラス名
+            # ベースの要素検索に影響しないが、念のため残しておく
+            chrome_options.add_experimental_option('prefs', {
+                'profile.managed_default_content_settings.images': 2,
+                'profile.managed_default_content_settings.fonts': 2,
+            })
+            chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+            chrome_options.add_argument("--disable-extensions")
+            chrome_options.add_argument("--disable-background-networking")
+            chrome_options.add_argument("--disable-sync")
+            chrome_options.add_argument("--disable-translate")
+
+            global _driver_path_cache
+            if _driver_path_cache is None or not os.path.exists(_driver_path_cache):
+                _driver_path_cache = ChromeDriverManager().install()
+            service = Service(_driver_path_cache)
             self.driver = webdriver.Chrome(service=service, options=chrome_options)
-            self.wait = WebDriverWait(self.driver, 10)
+            # 明示的な条件待ちに移行したぶんタイムアウトは長めに取る
+            # （条件が成立すれば即座に返るので平均待ち時間はむしろ短い）
+            self.wait = WebDriverWait(self.driver, 15)
 
             self.logger.info("WebDriver セットアップ完了")
             return True
@@ -93,12 +122,32 @@ class HacomonoScraper:
                 (By.PARTIAL_LINK_TEXT, store_name)
             ]
 
+            # 前回成功したセレクタを最優先で試す
+            cached_selector = self._store_selector_cache.get(store_name)
+            if cached_selector:
+                store_selectors.insert(0, cached_selector)
+
             for selector_type, selector in store_selectors:
                 try:
-                    store_element = self.wait.until(EC.element_to_be_clickable((selector_type, selector)))
+                    # find_elementsは待たずに即返るので、外れのセレクタごとに
+                    # タイムアウトまでブロックしない（当たりにだけ短い待ちを入れる）
+                    # ※プローブもtry内に置く。SPA描画中のStaleElementReference等で
+                    #   ループごと抜けてURLフォールバックを飛ばさないように
+                    elements = self.driver.find_elements(selector_type, selector)
+                    if not elements or not elements[0].is_displayed():
+                        continue
+                    store_element = WebDriverWait(self.driver, 2).until(
+                        EC.element_to_be_clickable((selector_type, selector)))
+                    current_url = self.driver.current_url
                     store_element.click()
+                    self._store_selector_cache[store_name] = (selector_type, selector)
                     self.logger.info(f"店舗選択成功: {store_name}")
-                    time.sleep(2)  # 店舗切り替え待機
+                    # 固定スリープではなく画面遷移の完了を待つ（SPA内で切り替わり
+                    # URLが変わらないケースもあるので、短めのタイムアウトで流す）
+                    try:
+                        WebDriverWait(self.driver, 5).until(EC.url_changes(current_url))
+                    except:
+                        pass
                     return True
                 except:
                     continue
@@ -119,8 +168,10 @@ class HacomonoScraper:
                 for pattern in store_patterns[store_name]:
                     try:
                         store_url = f"https://admin.hacomono.jp/stores/{pattern}/dashboard"
+                        # 遷移前のhtml要素が破棄された時点でページ切り替え完了とみなす
+                        old_page = self.driver.find_element(By.TAG_NAME, "html")
                         self.driver.get(store_url)
-                        time.sleep(3)
+                        self.wait.until(EC.staleness_of(old_page))
 
                         # 正しいページに移動できたかチェック
                         if store_name.replace("店", "") in self.driver.page_source:
@@ -155,8 +206,10 @@ class HacomonoScraper:
 
             for schedule_url in schedule_urls:
                 try:
+                    # 固定スリープではなく旧ページの破棄を待つ
+                    old_page = self.driver.find_element(By.TAG_NAME, "html")
                     self.driver.get(schedule_url)
-                    time.sleep(3)
+                    self.wait.until(EC.staleness_of(old_page))
 
                     # ページ読み込み待機（複数のパターンを試行）
                     page_indicators = [
@@ -186,6 +239,66 @@ class HacomonoScraper:
             self.logger.error(f"スケジュール画面遷移失敗: {e}")
             return False
 
+    # SPAバックエンドのJSONエンドポイント候補（DevToolsのNetworkタブで実URLを
+    # 特定したら先頭に固定する）。スケジュールURLと同じ当てずっぽう方式
+    _API_URL_CANDIDATES = [
+        "https://admin.hacomono.jp/api/schedule",
+        "https://admin.hacomono.jp/api/reservations",
+    ]
+
+    def _build_api_session(self):
+        """ログイン済みブラウザのクッキーを引き継いだrequests.Sessionを作る"""
+        session = requests.Session()
+        for cookie in self.driver.get_cookies():
+            session.cookies.set(cookie['name'], cookie['value'],
+                                domain=cookie.get('domain'))
+        return session
+
+    def fetch_reservations_via_api(self, session, target_date):
+        """JSONエンドポイントから予約を直接取得する
+
+        管理画面がSPAなら予約データはJSONで返ってくるはずなので、ブラウザの
+        レンダリングとWebDriver往復を丸ごとスキップできる。取得できなければ
+        Noneを返し、呼び出し側は従来のDOMスクレイピングにフォールバックする。
+        """
+        for api_url in self._API_URL_CANDIDATES:
+            try:
+                response = session.get(api_url, params={'date': target_date}, timeout=10)
+                if response.status_code != 200:
+                    continue
+                rows = response.json()
+                if isinstance(rows, dict):
+                    rows = rows.get('reservations') or rows.get('data')
+
+                # URLは当てずっぽうなので、予約リストと分かる中身がない
+                # レスポンス（{"status":"ok"}や200で返るエラーボディ等）は
+                # 成功扱いにせず、DOMスクレイピングのフォールバックに回す
+                if not isinstance(rows, list) or not rows:
+                    continue
+
+                reservations = []
+                for row in rows:
+                    start_time = (row.get('start') or row.get('start_time') or '').strip()
+                    end_time = (row.get('end') or row.get('end_time') or '').strip()
+                    status = (row.get('status') or '').strip()
+                    reservations.append({
+                        'date': target_date,
+                        'start': start_time,
+                        'end': end_time if end_time else self._add_hour(start_time),
+                        'type': self._determine_type(status),
+                        'status': status,
+                        'customer_name': row.get('customer_name') or 'N/A',
+                        'source': 'hacomono_scraping'
+                    })
+
+                self.logger.info(f"API直接取得成功: {target_date} ({len(reservations)}件)")
+                return reservations
+
+            except Exception:
+                continue
+
+        return None
+
     def extract_reservations(self, target_date=None):
         """予約情報を抽出"""
         try:
@@ -194,28 +307,28 @@ class HacomonoScraper:
 
             reservations = []
 
-            # 予約枠要素を取得（実際のhacomonoのHTML構造に合わせて調整が必要）
-            reservation_elements = self.driver.find_elements(
-                By.CLASS_NAME, "reservation-slot"
-            )
-
-            for element in reservation_elements:
+            # 予約枠のDOM読み取りをページ内JSの1回のexecute_scriptにまとめる。
+            # find_elementはスロットごとに最大4回のWebDriver往復になるが、
+            # これなら枠数によらず往復1回で済む
+            # （クラス名は実際のhacomonoのHTML構造に合わせて調整が必要）
+            rows = self.driver.execute_script("""
+                return Array.from(document.querySelectorAll('.reservation-slot')).map(el => ({
+                    time: (el.querySelector('.time-slot') || {}).innerText || '',
+                    status: (el.querySelector('.status') || {}).innerText || '',
+                    customer: (el.querySelector('.customer-name') || {}).innerText || ''
+                }));
+            """)
+
+            for row in rows:
                 try:
                     # 時間の抽出
-                    time_element = element.find_element(By.CLASS_NAME, "time-slot")
-                    time_text = time_element.text.strip()
+                    time_text = row['time'].strip()
 
                     # 状態の確認（ブロック、予約済み、など）
-                    status_element = element.find_element(By.CLASS_NAME, "status")
-                    status = status_element.text.strip()
+                    status = row['status'].strip()
 
                     # 予約者情報（あれば）
-                    customer_info = ""
-                    try:
-                        customer_element = element.find_element(By.CLASS_NAME, "customer-name")
-                        customer_info = customer_element.text.strip()
-                    except:
-                        pass
+                    customer_info = row['customer'].strip()
 
                     # 時間をstart/endに分割
                     if "～" in time_text or "-" in time_text:
@@ -264,51 +377,90 @@ class HacomonoScraper:
             return 'unknown'
 
     def _add_hour(self, time_str):
-        """時間に1時間を追加"""
+        """時間に1時間を追加（strptime/strftimeより1桁速い整数演算で）"""
         try:
-            time_obj = datetime.strptime(time_str, "%H:%M")
-            end_time = time_obj + timedelta(hours=1)
-            return end_time.strftime("%H:%M")
-        except:
+            hour, _, minute = time_str.partition(':')
+            return f"{(int(hour) + 1) % 24:02d}:{minute}"
+        except (ValueError, IndexError):
             return time_str
 
-    def fetch_reservations_for_date_range(self, start_date, end_date, email, password, store_name="半蔵門店"):
-        """指定期間の予約を取得"""
-        all_reservations = []
+    def _fetch_days(self, dates, email, password, store_name):
+        """担当分の日付をワーカー専用ドライバで順に取得（スレッドから呼ばれる）
 
-        if not self.setup_driver():
-            return all_reservations
+        WebDriverはスレッドセーフではないので、ワーカーごとに独立した
+        スクレイパー（=独立したChromeインスタンス）を立てる。起動と
+        ログインはワーカーにつき1回だけ行い、担当の日付を順に回す。
+        """
+        worker = HacomonoScraper()
+        reservations = []
+
+        if not worker.setup_driver():
+            return reservations
 
         try:
-            # ログイン
-            if not self.login(email, password):
-                return all_reservations
+            if not worker.login(email, password):
+                return reservations
+
+            session = worker._build_api_session()
+
+            for date_str in dates:
+                # まずJSON APIの直叩きを試し、ダメならDOMスクレイピングに落とす
+                daily_reservations = worker.fetch_reservations_via_api(session, date_str)
+                if daily_reservations is None:
+                    daily_reservations = []
+                    if worker.navigate_to_schedule(date_str, store_name):
+                        daily_reservations = worker.extract_reservations(date_str)
+                # 店舗名を追加
+                for reservation in daily_reservations:
+                    reservation['store_name'] = store_name
+                reservations.extend(daily_reservations)
+
+                # サーバー負荷軽減（グローバルではなくワーカーごとにジッター付きで待つ）
+                time.sleep(random.uniform(0.5, 1.5))
+
+        except Exception as e:
+            worker.logger.error(f"担当分の取得でエラー: {e}")
 
-            current_date = datetime.strptime(start_date, "%Y-%m-%d")
-            end_date_obj = datetime.strptime(end_date, "%Y-%m-%d")
+        finally:
+            worker.cleanup()
+
+        return reservations
+
+    def fetch_reservations_for_date_range(self, start_date, end_date, email, password, store_name="半蔵門店"):
+        """指定期間の予約を取得（日付ごとに並列取得）
+
+        各日付の取得はページ遷移待ちが大半のI/O処理なので、スレッドプールで
+        重ねると期間が長いほど直列ループに対してほぼ線形に短縮できる。
+        """
+        all_reservations = []
 
-            while current_date <= end_date_obj:
-                date_str = current_date.strftime("%Y-%m-%d")
+        current_date = datetime.strptime(start_date, "%Y-%m-%d")
+        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d")
+        dates = []
+        while current_date <= end_date_obj:
+            dates.append(current_date.strftime("%Y-%m-%d"))
+            current_date += timedelta(days=1)
 
-                # 各日付のスケジュール画面に遷移（店舗指定）
-                if self.navigate_to_schedule(date_str, store_name):
-                    # 予約情報を抽出
-                    daily_reservations = self.extract_reservations(date_str)
-                    # 店舗名を追加
-                    for reservation in daily_reservations:
-                        reservation['store_name'] = store_name
-                    all_reservations.extend(daily_reservations)
+        if not dates:
+            return all_reservations
 
-                # 次の日へ
-                current_date += timedelta(days=1)
-                time.sleep(1)  # サーバー負荷軽減
+        try:
+            # 日付を連続したチャンクに分け、ワーカー1つにつきドライバ起動と
+            # ログインを1回で済ませる（日付ごとに起動・ログインすると
+            # 30日レンジで30回ログインすることになり、本末転倒）
+            workers = min(4, len(dates))
+            chunk_size = -(-len(dates) // workers)  # 切り上げ
+            chunks = [dates[i:i + chunk_size] for i in range(0, len(dates), chunk_size)]
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for chunk_reservations in executor.map(
+                        lambda chunk: self._fetch_days(chunk, email, password, store_name),
+                        chunks):
+                    all_reservations.extend(chunk_reservations)
 
         except Exception as e:
             self.logger.error(f"期間取得処理でエラー: {e}")
 
-        finally:
-            self.cleanup()
-
         return all_reservations
 
     def cleanup(self):
@@ -1,7 +1,9 @@
 import re
+import sys
+import hashlib
 from datetime import datetime
 from dataclasses import dataclass
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable, Tuple
 
 @dataclass
 class ReservationInfo:
@@ -38,10 +40,43 @@ class HALLELReservationClassifier:
             "キャンセル完了"
         ]
 
-        # 日時パターン
-        self.date_pattern = r'(\d{4})年(\d{1,2})月(\d{1,2})日'
-        self.time_pattern = r'(\d{1,2}):(\d{2})~(\d{1,2}):(\d{2})'
-        self.customer_pattern = r'(.*?)\s*様'
+        # 予約・キャンセルのキーワードは1本の選択肢付き正規表現にまとめ、
+        # finditerの1パスで全ヒットを拾う（キーワードごとのin検索だと
+        # リスト長×本文長ぶんの走査になる）
+        # 「予約をキャンセルいたしました」のようにキーワード同士が重なって
+        # 出現しても従来のin検索と同じヒット集合になるよう、先読みで
+        # ゼロ幅マッチにして重複区間も拾う
+        self.keyword_re = re.compile(
+            '(?=(?P<cancellation>' + '|'.join(map(re.escape, self.cancellation_keywords)) + ')'
+            '|(?P<booking>' + '|'.join(map(re.escape, self.booking_keywords)) + '))'
+        )
+
+        # 日時パターン（メールごとにre.searchのキャッシュ参照を挟まないよう、
+        # ここでコンパイルしてPatternのboundメソッドを直接呼ぶ）
+        self.date_re = re.compile(r'(\d{4})年(\d{1,2})月(\d{1,2})日')
+        self.time_re = re.compile(r'(\d{1,2}):(\d{2})~(\d{1,2}):(\d{2})')
+        # HALLELメールでは「2025年11月16日(日) 10:00~11:00」のように日付と
+        # 時刻が隣接するので、結合パターンなら本文1回の走査で両方取れる
+        self.datetime_re = re.compile(
+            r'(\d{4})年(\d{1,2})月(\d{1,2})日\D{0,40}?(\d{1,2}):(\d{2})~(\d{1,2}):(\d{2})')
+        # "渋谷店 STUDIO ⑥ (1)" のようなパターン
+        self.studio_re = re.compile(r'(渋谷店\s*STUDIO\s*[⑥①②③④⑤⑦⑧⑨⑩]*\s*\(\d+\))')
+
+        # 店舗判定用のASCIIトークン。.lower()で本文の全文コピーを作らず、
+        # IGNORECASE検索で大小文字（Hallelのような混在も）を吸収する
+        self.hallel_re = re.compile(r'hallel', re.IGNORECASE)
+        self.hanzomon_re = re.compile(r'hanzomon', re.IGNORECASE)
+        self.shibuya_re = re.compile(r'shibuya', re.IGNORECASE)
+
+        # キーワードごとの信頼度加点。いまはカテゴリ一律だが、個別に効きを
+        # 調整できるよう辞書で持ち、信頼度計算はヒット集合の引き算だけにする
+        self.kw_weights = {keyword: 0.1 for keyword in self.booking_keywords}
+        self.kw_weights.update({keyword: 0.15 for keyword in self.cancellation_keywords})
+
+        # 分類結果のキャッシュ。ポーリングやリトライで同じメールが繰り返し
+        # 来るので、2回目以降はdict参照だけで返す。本文を丸ごとキーに持つと
+        # 長文を抱え込むため16バイトのダイジェストをキーにする
+        self._classify_cache = {}
 
     def classify_email(self, subject: str, body: str) -> Optional[ReservationInfo]:
         """
@@ -54,87 +89,95 @@ class HALLELReservationClassifier:
         Returns:
             ReservationInfo: 分析結果、分類できない場合はNone
         """
-        try:
-            # HALLELメールかどうかチェック
-            if not self._is_hallel_email(subject, body):
-                return None
+        key = hashlib.blake2b(f"{subject}\x00{body}".encode(), digest_size=16).digest()
+        if key in self._classify_cache:
+            return self._classify_cache[key]
 
-            # アクションタイプを判定
-            action_type = self._determine_action_type(body)
-            if not action_type:
-                return None
+        result = self._classify_email(subject, body)
 
-            # 顧客名を抽出
-            customer_name = self._extract_customer_name(body)
+        # キャッシュが伸びすぎたら丸ごと作り直す
+        if len(self._classify_cache) >= 1024:
+            self._classify_cache.clear()
+        self._classify_cache[key] = result
+        return result
 
-            # 日時を抽出
-            date_info = self._extract_date_time(body)
-            if not date_info:
-                return None
+    def _classify_email(self, subject: str, body: str) -> Optional[ReservationInfo]:
+        """分類の本体（キャッシュミス時のみ呼ばれる）
 
-            # スタジオ情報を抽出
-            studio_info = self._extract_studio_info(body)
-
-            # 信頼度を計算
-            confidence = self._calculate_confidence(action_type, body)
-
-            return ReservationInfo(
-                action_type=action_type,
-                date=date_info['date'],
-                start_time=date_info['start_time'],
-                end_time=date_info['end_time'],
-                customer_name=customer_name,
-                studio=studio_info,
-                duration_minutes=date_info['duration'],
-                confidence=confidence,
-                raw_text=body
-            )
-
-        except Exception as e:
-            print(f"メール分類エラー: {e}")
+        「HALLELメールでない」「日時が取れない」といった想定内の不一致は
+        明示的なreturn Noneで返す。想定外の例外は握りつぶさず呼び出し側
+        （同期処理のtry/except）へ伝播させる。
+        """
+        # HALLELメールかどうかチェック
+        if not self._is_hallel_email(subject, body):
             return None
 
+        # キーワードを本文1パスで収集し、判定と信頼度計算で使い回す
+        keyword_hits = self._scan_keywords(body)
+
+        # アクションタイプを判定
+        action_type = self._determine_action_type(body, keyword_hits)
+        if not action_type:
+            return None
+
+        # 顧客名を抽出
+        customer_name = self._extract_customer_name(body)
+
+        # 日時を抽出
+        date_info = self._extract_date_time(body)
+        if not date_info:
+            return None
+
+        # スタジオ情報を抽出
+        studio_info = self._extract_studio_info(body)
+
+        # 信頼度を計算
+        confidence = self._calculate_confidence(action_type, body, keyword_hits)
+
+        return ReservationInfo(
+            action_type=action_type,
+            date=date_info['date'],
+            start_time=date_info['start_time'],
+            end_time=date_info['end_time'],
+            customer_name=customer_name,
+            studio=studio_info,
+            duration_minutes=date_info['duration'],
+            confidence=confidence,
+            raw_text=body
+        )
+
     def _is_hallel_email(self, subject: str, body: str) -> bool:
         """HALLELからのメールかどうか判定（渋谷店限定）"""
         # まずHALLELメールかチェック
-        hallel_indicators = [
-            "HALLEL",
-            "hallel"
-        ]
-
-        combined_text = f"{subject} {body}".lower()
-        is_hallel = any(indicator.lower() in combined_text for indicator in hallel_indicators)
-
-        if not is_hallel:
+        if not (self.hallel_re.search(subject) or self.hallel_re.search(body)):
             return False
 
         # 渋谷店のメールかチェック（半蔵門店を除外）
-        if "半蔵門店" in body or "hanzomon" in body.lower():
+        if "半蔵門店" in body or self.hanzomon_re.search(body):
             return False
 
-        # 渋谷店であることを確認
-        if "渋谷店" in body or "shibuya" in body.lower():
-            return True
+        # 渋谷店であることを確認（明示的に店舗情報がない場合は保留・要検討）
+        return "渋谷店" in body or self.shibuya_re.search(body) is not None
 
-        # 明示的に店舗情報がない場合は保留（要検討）
-        return False
+    def _scan_keywords(self, body: str) -> Dict[str, set]:
+        """カテゴリごとのキーワードヒットを本文1パスで収集"""
+        hits = {'booking': set(), 'cancellation': set()}
+        for match in self.keyword_re.finditer(body):
+            hits[match.lastgroup].add(match.group(match.lastgroup))
+        return hits
 
-    def _determine_action_type(self, body: str) -> Optional[str]:
+    def _determine_action_type(self, body: str, keyword_hits: Dict[str, set]) -> Optional[str]:
         """予約かキャンセルかを判定"""
-        body_lower = body.lower()
-
         # キャンセルキーワードのチェック（優先度高）
-        for keyword in self.cancellation_keywords:
-            if keyword in body:
-                return 'cancellation'
+        if keyword_hits['cancellation']:
+            return 'cancellation'
 
         # 予約完了キーワードのチェック
-        for keyword in self.booking_keywords:
-            if keyword in body:
-                return 'booking'
+        if keyword_hits['booking']:
+            return 'booking'
 
         # 件名でも判定
-        if 'キャンセル' in body or 'cancel' in body_lower:
+        if 'キャンセル' in body or 'cancel' in body.lower():
             return 'cancellation'
         elif '予約' in body and ('ありがとう' in body or '承り' in body):
             return 'booking'
@@ -143,43 +186,51 @@ class HALLELReservationClassifier:
 
     def _extract_customer_name(self, body: str) -> str:
         """顧客名を抽出"""
-        match = re.search(self.customer_pattern, body)
-        if match:
-            name = match.group(1).strip()
-            # "辻 克哉" のような形式
-            return name
-        return "不明"
+        # 「(.*?)\s*様」の遅延マッチは開始位置ごとのバックトラックになるので、
+        # C実装のfindで様の位置を直接探し、直前の行を切り出す
+        idx = body.find('様')
+        if idx < 0:
+            return "不明"
+
+        # 様の直前の空白（改行含む）を飛ばし、その行の先頭までを名前とみなす
+        end = idx
+        while end > 0 and body[end - 1].isspace():
+            end -= 1
+        start = body.rfind('\n', 0, end) + 1
+
+        # "辻 克哉" のような形式
+        return body[start:end].strip()
 
     def _extract_date_time(self, body: str) -> Optional[Dict[str, Any]]:
         """日時情報を抽出"""
-        # 日付を抽出
-        date_match = re.search(self.date_pattern, body)
-        if not date_match:
-            return None
+        # まず日付+時刻の結合パターンで1回だけ走査する
+        match = self.datetime_re.search(body)
+        if match:
+            groups = match.groups()
+        else:
+            # 日付と時刻が離れている・順序が違うメール用のフォールバック
+            date_match = self.date_re.search(body)
+            if not date_match:
+                return None
 
-        year = int(date_match.group(1))
-        month = int(date_match.group(2))
-        day = int(date_match.group(3))
+            # 時間を抽出
+            time_match = self.time_re.search(body)
+            if not time_match:
+                return None
 
-        # 時間を抽出
-        time_match = re.search(self.time_pattern, body)
-        if not time_match:
-            return None
+            groups = date_match.groups() + time_match.groups()
 
-        start_hour = int(time_match.group(1))
-        start_minute = int(time_match.group(2))
-        end_hour = int(time_match.group(3))
-        end_minute = int(time_match.group(4))
+        year, month, day, start_hour, start_minute, end_hour, end_minute = groups
 
-        # 形式を統一
-        date_str = f"{year:04d}-{month:02d}-{day:02d}"
-        start_time = f"{start_hour:02d}:{start_minute:02d}"
-        end_time = f"{end_hour:02d}:{end_minute:02d}"
+        # 形式を統一。正規表現が桁数を保証しているので、int化してformat指定で
+        # 戻す往復はせず、zfillと連結で揃える（年は\d{4}、分は\d{2}でそのまま）
+        date_str = year + '-' + month.zfill(2) + '-' + day.zfill(2)
+        start_time = start_hour.zfill(2) + ':' + start_minute
+        end_time = end_hour.zfill(2) + ':' + end_minute
 
-        # 利用時間を計算
-        start_minutes = start_hour * 60 + start_minute
-        end_minutes = end_hour * 60 + end_minute
-        duration = end_minutes - start_minutes
+        # 利用時間を計算（ここだけint化が要る）
+        duration = ((int(end_hour) - int(start_hour)) * 60
+                    + int(end_minute) - int(start_minute))
 
         return {
             'date': date_str,
@@ -190,9 +241,7 @@ class HALLELReservationClassifier:
 
     def _extract_studio_info(self, body: str) -> str:
         """スタジオ情報を抽出"""
-        # "渋谷店 STUDIO ⑥ (1)" のようなパターン
-        studio_pattern = r'(渋谷店\s*STUDIO\s*[⑥①②③④⑤⑦⑧⑨⑩]*\s*\(\d+\))'
-        match = re.search(studio_pattern, body)
+        match = self.studio_re.search(body)
         if match:
             return match.group(1).strip()
 
@@ -202,40 +251,42 @@ class HALLELReservationClassifier:
 
         return "不明"
 
-    def _calculate_confidence(self, action_type: str, body: str) -> float:
-        """信頼度を計算（0.0-1.0）"""
+    def _calculate_confidence(self, action_type: str, body: str,
+                              keyword_hits: Dict[str, set]) -> float:
+        """信頼度を計算（0.0-1.0）
+
+        呼び出し時点で_extract_date_timeが成功している（=日付・時刻とも
+        マッチ済み）ことを前提に、本文の再スキャンはHALLEL表記の1回だけに
+        して、残りは事前計算済みの結果からの加点にする。
+        """
         confidence = 0.5  # ベース信頼度
 
-        # キーワードマッチングによる信頼度向上
-        if action_type == 'booking':
-            for keyword in self.booking_keywords:
-                if keyword in body:
-                    confidence += 0.1
-        elif action_type == 'cancellation':
-            for keyword in self.cancellation_keywords:
-                if keyword in body:
-                    confidence += 0.15
-
-        # 構造化された情報の存在確認
-        if re.search(self.date_pattern, body):
-            confidence += 0.1
-        if re.search(self.time_pattern, body):
-            confidence += 0.1
+        # キーワードマッチングによる信頼度向上（_scan_keywordsの結果と
+        # 重み辞書の参照だけで、本文には触らない）
+        for keyword in keyword_hits.get(action_type, ()):
+            confidence += self.kw_weights[keyword]
+
+        # 構造化された情報の存在確認（日付・時刻は抽出成功済みなので定数加点）
+        confidence += 0.2
         if "HALLEL" in body:
             confidence += 0.1
 
         return min(confidence, 1.0)
 
-    def test_classification(self, test_emails: list) -> None:
-        """テスト用メソッド"""
+    def test_classification(self, test_emails: Iterable[Tuple[str, str]]) -> None:
+        """テスト用メソッド（リストでもジェネレータでも受け取れる）"""
+        # 1行ごとのprintではなく、まとめて1回のwriteで書き出す
+        out = []
         for i, (subject, body) in enumerate(test_emails):
-            print(f"\n=== テストメール {i+1} ===")
+            out.append(f"\n=== テストメール {i+1} ===")
             result = self.classify_email(subject, body)
             if result:
-                print(f"アクション: {result.action_type}")
-                print(f"日時: {result.date} {result.start_time}-{result.end_time}")
-                print(f"顧客: {result.customer_name}")
-                print(f"スタジオ: {result.studio}")
-                print(f"信頼度: {result.confidence:.2f}")
+                out.append(f"アクション: {result.action_type}")
+                out.append(f"日時: {result.date} {result.start_time}-{result.end_time}")
+                out.append(f"顧客: {result.customer_name}")
+                out.append(f"スタジオ: {result.studio}")
+                out.append(f"信頼度: {result.confidence:.2f}")
             else:
-                print("分類できませんでした")
\ No newline at end of file
+                out.append("分類できませんでした")
+        if out:
+            sys.stdout.write('\n'.join(out) + '\n')
\ No newline at end of file
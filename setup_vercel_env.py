@@ -8,16 +8,12 @@ import os
 import json
 import subprocess
 import secrets
-import tempfile
 
 def run_command(cmd, input_text=None):
-    """コマンドを実行"""
+    """コマンドを実行（cmdは引数リスト。シェルを挟まない）"""
     try:
-        if input_text:
-            result = subprocess.run(cmd, shell=True, input=input_text,
-                                  text=True, capture_output=True)
-        else:
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        result = subprocess.run(cmd, input=input_text,
+                                text=True, capture_output=True)
         return result.returncode == 0, result.stdout, result.stderr
     except Exception as e:
         return False, "", str(e)
@@ -26,24 +22,34 @@ def set_vercel_env_var(name, value):
     """Vercel環境変数を設定"""
     print(f"🔧 環境変数 {name} を設定中...")
 
-    # 一時ファイルに値を書き込み
-    with tempfile.NamedTemporaryFile(mode='w', delete=False) as tmp:
-        tmp.write(value)
-        tmp_path = tmp.name
+    # 値はstdinで直接渡す（シェルもcatも一時ファイルも挟まない）
+    success, stdout, stderr = run_command(
+        ["vercel", "env", "add", name, "production"], input_text=value)
+
+    if success:
+        print(f"✅ {name} 設定完了")
+    else:
+        print(f"❌ {name} 設定失敗: {stderr}")
+
+    return success
+
+def set_vercel_env_var_from_file(name, path):
+    """ファイルの中身をメモリに読み込まず、そのままstdinとして渡して設定"""
+    print(f"🔧 環境変数 {name} を設定中...")
 
     try:
-        # Vercel CLIで環境変数を設定
-        cmd = f'cat "{tmp_path}" | vercel env add {name} production'
-        success, stdout, stderr = run_command(cmd)
+        with open(path, 'rb') as f:
+            result = subprocess.run(["vercel", "env", "add", name, "production"],
+                                    stdin=f, capture_output=True, text=True)
+        success = result.returncode == 0
+        stderr = result.stderr
+    except Exception as e:
+        success, stderr = False, str(e)
 
-        if success:
-            print(f"✅ {name} 設定完了")
-        else:
-            print(f"❌ {name} 設定失敗: {stderr}")
-            return False
-    finally:
-        # 一時ファイルを削除
-        os.unlink(tmp_path)
+    if success:
+        print(f"✅ {name} 設定完了")
+    else:
+        print(f"❌ {name} 設定失敗: {stderr}")
 
     return success
 
@@ -61,9 +67,7 @@ def setup_vercel_environment():
     # 2. GMAIL_CREDENTIALS_JSON設定
     print("\\n2. GMAIL_CREDENTIALS_JSON 設定:")
     if os.path.exists('credentials.json'):
-        with open('credentials.json', 'r') as f:
-            credentials_json = f.read()
-        if not set_vercel_env_var("GMAIL_CREDENTIALS_JSON", credentials_json):
+        if not set_vercel_env_var_from_file("GMAIL_CREDENTIALS_JSON", 'credentials.json'):
             return False
     else:
         print("❌ credentials.json が見つかりません")
@@ -72,9 +76,7 @@ def setup_vercel_environment():
     # 3. GMAIL_TOKEN_JSON設定
     print("\\n3. GMAIL_TOKEN_JSON 設定:")
     if os.path.exists('token.json'):
-        with open('token.json', 'r') as f:
-            token_json = f.read()
-        if not set_vercel_env_var("GMAIL_TOKEN_JSON", token_json):
+        if not set_vercel_env_var_from_file("GMAIL_TOKEN_JSON", 'token.json'):
             return False
     else:
         print("❌ token.json が見つかりません")
@@ -89,7 +91,7 @@ def setup_vercel_environment():
 def deploy_with_env_vars():
     """環境変数設定後にデプロイ"""
     print("\\n🚀 本番環境に再デプロイ中...")
-    success, stdout, stderr = run_command("vercel --prod")
+    success, stdout, stderr = run_command(["vercel", "--prod"])
 
     if success:
         print("✅ デプロイ完了")
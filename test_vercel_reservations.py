@@ -5,6 +5,7 @@ Vercel本番環境での予約システムテスト
 
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 # Vercel本番環境URL
@@ -14,6 +15,11 @@ def login_and_get_session():
     """ログインしてセッションを取得"""
     session = requests.Session()
 
+    # 同一ホストへ連続でリクエストするので、プールを固定してTCP+TLS
+    # ハンドシェイクを初回の1回だけにする（以降はkeep-aliveで使い回し）
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+    session.mount('https://', adapter)
+
     # ログインページにアクセス
     login_page = session.get(f"{BASE_URL}/login")
     print(f"ログインページアクセス: {login_page.status_code}")
@@ -55,9 +61,10 @@ def test_gmail_sync(session):
 
     return response.status_code == 200
 
-def check_reservations():
-    """現在の予約状況確認"""
-    response = requests.get(f"{BASE_URL}/api/reservations")
+def check_reservations(session=None):
+    """現在の予約状況確認（セッションを渡せば接続を使い回す）"""
+    client = session if session is not None else requests
+    response = client.get(f"{BASE_URL}/api/reservations")
     print(f"予約確認: {response.status_code}")
 
     if response.status_code == 200:
@@ -91,17 +98,18 @@ def main():
         print("❌ テスト中断: ログインに失敗しました")
         return
 
-    # 3. 手動予約追加テスト
-    print("\n3. 手動予約追加テスト:")
-    manual_success = test_add_manual_reservation(session)
-
-    # 4. Gmail同期テスト
-    print("\n4. Gmail同期テスト:")
-    gmail_success = test_gmail_sync(session)
+    # 3-4. 手動予約追加とGmail同期は互いに独立なので並行で投げる
+    # （requests.Sessionは別リクエスト同士ならスレッドセーフ）
+    print("\n3-4. 手動予約追加テスト / Gmail同期テスト (並行実行):")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        manual_future = executor.submit(test_add_manual_reservation, session)
+        gmail_future = executor.submit(test_gmail_sync, session)
+        manual_success = manual_future.result()
+        gmail_success = gmail_future.result()
 
-    # 5. 結果確認
+    # 5. 結果確認（ログイン済みセッションの接続を使い回す）
     print("\n5. テスト後の予約状況:")
-    check_reservations()
+    check_reservations(session)
 
     # 結果サマリー
     print("\n" + "=" * 50)